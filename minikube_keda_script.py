@@ -1,64 +1,209 @@
+import asyncio
+import functools
 import os
+import shutil
 import subprocess
-import yaml
-from kubernetes import client, config
+import sys
+import tempfile
+import time
+import types
+import urllib.request
+import urllib3
+from concurrent.futures import ThreadPoolExecutor
+from kubernetes import client, config, watch
+from kubernetes.client import rest
 
-def run_shell_command(command):
-    """Run a shell command and return the output."""
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    # The REST client serializes request bodies with json.dumps; route that through orjson when available.
+    rest.json = types.SimpleNamespace(dumps=orjson.dumps, loads=orjson.loads)
+
+FIELD_MANAGER = "keda-script"
+APPLY_PATCH_CONTENT_TYPE = "application/apply-patch+yaml"
+KEDA_CHART_REPO_URL = "https://kedacore.github.io/charts"
+HELM_INSTALL_SCRIPT_URL = "https://raw.githubusercontent.com/helm/helm/master/scripts/get-helm-3"
+
+async def run_shell_command(command):
+    """Run a command (given as an argument list) and return the output."""
+    # CPython only uses posix_spawn for an executable given by path with close_fds=False;
+    # our own descriptors are non-inheritable (PEP 446), so nothing leaks to the child.
+    executable = shutil.which(command[0])
+    if executable is None:
+        raise FileNotFoundError(f"Command not found: {command[0]}")
+    process = await asyncio.create_subprocess_exec(
+        executable,
+        *command[1:],
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        close_fds=False
+    )
     try:
-        result = subprocess.run(command, shell=True, check=True, text=True, capture_output=True)
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        print(f"Error executing command: {command}\n{e.stderr}")
+        stdout, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        # Don't leave the child running when the caller gives up on it.
+        process.kill()
+        await process.wait()
         raise
+    if process.returncode != 0:
+        print(f"Error executing command: {' '.join(command)}\n{stderr.decode()}")
+        raise subprocess.CalledProcessError(process.returncode, command, stdout.decode(), stderr.decode())
+    return stdout.decode().strip()
+
+# Deployment health results keyed by (name, namespace) -> (timestamp, status).
+CACHE_TTL = 1.0
+_health_cache = {}
+
+def _api_call(action):
+    """Decorate a Kubernetes API helper so ApiExceptions are logged before propagating."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            except client.exceptions.ApiException as e:
+                print(f"Exception when {action}: {e}")
+                raise
+        return wrapper
+    return decorator
+
+# Shared API client and API objects, built once the kubeconfig has been loaded.
+_API = None
+_APPS = None
+_CORE = None
+_CO = None
 
 def load_minikube_config():
     """Load Minikube Kubernetes configuration."""
+    global _API, _APPS, _CORE, _CO
     print("Setting up Minikube context...")
     config.load_kube_config(context="minikube")
+    # The Python client only deserializes JSON, so keep the default Accept header.
+    # A small pool lets concurrent calls share connections.
+    configuration = client.Configuration.get_default_copy()
+    configuration.connection_pool_maxsize = 8
+    _API = client.ApiClient(configuration)
+    _APPS = client.AppsV1Api(_API)
+    _CORE = client.CoreV1Api(_API)
+    _CO = client.CustomObjectsApi(_API)
+
+def _minikube_reachable():
+    """Return True if the Minikube API server answers a version request."""
+    # Fail fast: no urllib3 retries and a short connect timeout, so an unreachable
+    # cluster falls through to `minikube start` quickly.
+    configuration = client.Configuration()
+    configuration.retries = 0
+    try:
+        config.load_kube_config(context="minikube", client_configuration=configuration)
+        client.VersionApi(client.ApiClient(configuration)).get_code(_request_timeout=(2, 5))
+        return True
+    except (config.ConfigException, urllib3.exceptions.HTTPError, client.exceptions.ApiException):
+        return False
 
-def start_minikube():
+async def start_minikube():
     """Start Minikube if it is not already running."""
     try:
-        status = run_shell_command("minikube status")
-        if "Running" in status:
+        loop = asyncio.get_running_loop()
+        if await loop.run_in_executor(None, _minikube_reachable):
             print("Minikube is already running.")
         else:
             print("Starting Minikube...")
-            run_shell_command("minikube start")
+            await run_shell_command(["minikube", "start"])
     except Exception as e:
         print(f"Error checking Minikube status: {e}")
         raise
 
-def install_helm():
+def _download(url, destination):
+    """Download url into the open binary file destination."""
+    with urllib.request.urlopen(url) as response:
+        shutil.copyfileobj(response, destination)
+    destination.flush()
+
+async def install_helm():
     """Install Helm if not already installed."""
-    try:
-        print("Checking if Helm is installed...")
-        run_shell_command("helm version")
+    print("Checking if Helm is installed...")
+    if shutil.which("helm") is not None:
         print("Helm is already installed.")
-    except:
+    else:
         print("Helm not found. Installing Helm...")
-        run_shell_command("curl https://raw.githubusercontent.com/helm/helm/master/scripts/get-helm-3 | bash")
+        loop = asyncio.get_running_loop()
+        with tempfile.NamedTemporaryFile(suffix=".sh") as script:
+            await loop.run_in_executor(None, _download, HELM_INSTALL_SCRIPT_URL, script)
+            await run_shell_command(["bash", script.name])
 
-def install_keda():
+async def install_keda():
     """Install KEDA on the Kubernetes cluster using Helm."""
     print("Installing KEDA...")
-    run_shell_command("helm repo add kedacore https://kedacore.github.io/charts")
-    run_shell_command("helm repo update")
-    run_shell_command("helm install keda kedacore/keda --namespace keda --create-namespace")
+    await run_shell_command(["helm", "install", "keda", "keda", "--repo", KEDA_CHART_REPO_URL, "--namespace", "keda", "--create-namespace"])
     print("KEDA installed successfully.")
 
-def verify_keda_installation():
+@_api_call("verifying KEDA deployments")
+def _wait_for_deployments_available(namespace, timeout=60):
+    """Watch the deployments in a namespace until all of them have rolled out, returning their status by name.
+
+    helm install creates every chart resource before returning, so the listed set is complete.
+    """
+    deadline = time.monotonic() + timeout
+
+    while True:
+        deployment_list = _APPS.list_namespaced_deployment(namespace=namespace)
+        deployments = {d.metadata.name: _deployment_health_status(d) for d in deployment_list.items}
+        if deployments and all(status == "Healthy" for status in deployments.values()):
+            return deployments
+
+        remaining = int(deadline - time.monotonic())
+        if remaining <= 0:
+            return deployments
+
+        w = watch.Watch()
+        try:
+            for event in w.stream(
+                _APPS.list_namespaced_deployment,
+                namespace=namespace,
+                resource_version=deployment_list.metadata.resource_version,
+                timeout_seconds=remaining,
+            ):
+                deployment = event["object"]
+                if event["type"] == "DELETED":
+                    deployments.pop(deployment.metadata.name, None)
+                else:
+                    deployments[deployment.metadata.name] = _deployment_health_status(deployment)
+                if deployments and all(status == "Healthy" for status in deployments.values()):
+                    return deployments
+            return deployments
+        except client.exceptions.ApiException as e:
+            # 410 Gone: our resource version expired, relist and watch again.
+            if e.status != 410:
+                raise
+        finally:
+            w.stop()
+
+async def verify_keda_installation():
     """Verify that KEDA is installed and running."""
     print("Verifying KEDA installation...")
-    pods = run_shell_command("kubectl get pods -n keda")
-    print(pods)
+    loop = asyncio.get_running_loop()
+    deployments = await loop.run_in_executor(None, _wait_for_deployments_available, "keda")
+    for name, status in deployments.items():
+        print(f"{name}: {status}")
+    if not deployments or not all(status == "Healthy" for status in deployments.values()):
+        print("KEDA deployments did not become available in time.")
 
-def create_deployment(deployment_name, image, namespace="default", cpu_request="100m", cpu_limit="200m", memory_request="128Mi", memory_limit="256Mi", ports=None):
-    """Create a Kubernetes deployment."""
-    ports = ports or []
-    container_ports = [{"containerPort": port} for port in ports]
+@functools.lru_cache(maxsize=None)
+def _container_ports(ports):
+    """Build the container port specs for a tuple of ports (shared, do not mutate)."""
+    return tuple({"containerPort": port} for port in ports)
+
+@functools.lru_cache(maxsize=None)
+def _service_ports(ports):
+    """Build the service port specs for a tuple of ports (shared, do not mutate)."""
+    return tuple({"port": port, "targetPort": port} for port in ports)
 
+@_api_call("applying deployment")
+def create_deployment(deployment_name, image, namespace="default", cpu_request="100m", cpu_limit="200m", memory_request="128Mi", memory_limit="256Mi", ports=None):
+    """Create or update a Kubernetes deployment via server-side apply."""
     deployment = {
         "apiVersion": "apps/v1",
         "kind": "Deployment",
@@ -94,7 +239,7 @@ def create_deployment(deployment_name, image, namespace="default", cpu_request="
                                     "memory": memory_limit
                                 }
                             },
-                            "ports": container_ports
+                            "ports": _container_ports(tuple(ports)) if ports else ()
                         }
                     ]
                 }
@@ -102,57 +247,56 @@ def create_deployment(deployment_name, image, namespace="default", cpu_request="
         }
     }
 
-    api_instance = client.AppsV1Api()
-    try:
-        response = api_instance.create_namespaced_deployment(
-            body=deployment,
-            namespace=namespace
-        )
-        print(f"Deployment {deployment_name} created in namespace {namespace}.")
-        return response.metadata.uid
-    except client.exceptions.ApiException as e:
-        print(f"Exception when creating deployment: {e}")
-        raise
+    response = _APPS.patch_namespaced_deployment(
+        name=deployment_name,
+        namespace=namespace,
+        body=deployment,
+        field_manager=FIELD_MANAGER,
+        force=True,
+        _content_type=APPLY_PATCH_CONTENT_TYPE
+    )
+    print(f"Deployment {deployment_name} applied in namespace {namespace}.")
+    return response.metadata.name
 
+@_api_call("applying service")
 def create_service(deployment_name, namespace="default", ports=None):
-    """Create a Kubernetes service for a deployment."""
-    ports = ports or []
-    service_ports = [{"port": port, "targetPort": port} for port in ports]
-
+    """Create or update a Kubernetes service for a deployment via server-side apply."""
+    service_name = sys.intern(deployment_name + "-service")
     service = {
         "apiVersion": "v1",
         "kind": "Service",
         "metadata": {
-            "name": f"{deployment_name}-service",
+            "name": service_name,
             "namespace": namespace
         },
         "spec": {
             "selector": {
                 "app": deployment_name
             },
-            "ports": service_ports
+            "ports": _service_ports(tuple(ports)) if ports else ()
         }
     }
 
-    api_instance = client.CoreV1Api()
-    try:
-        response = api_instance.create_namespaced_service(
-            body=service,
-            namespace=namespace
-        )
-        print(f"Service {deployment_name}-service created in namespace {namespace}.")
-        return response.metadata.name
-    except client.exceptions.ApiException as e:
-        print(f"Exception when creating service: {e}")
-        raise
+    response = _CORE.patch_namespaced_service(
+        name=service_name,
+        namespace=namespace,
+        body=service,
+        field_manager=FIELD_MANAGER,
+        force=True,
+        _content_type=APPLY_PATCH_CONTENT_TYPE
+    )
+    print(f"Service {service_name} applied in namespace {namespace}.")
+    return response.metadata.name
 
+@_api_call("applying ScaledObject")
 def create_scaled_object(deployment_name, metric_name, threshold, namespace="default"):
-    """Create a KEDA ScaledObject for event-driven scaling."""
+    """Create or update a KEDA ScaledObject for event-driven scaling via server-side apply."""
+    scaled_object_name = sys.intern(deployment_name + "-scaledobject")
     scaled_object = {
         "apiVersion": "keda.sh/v1alpha1",
         "kind": "ScaledObject",
         "metadata": {
-            "name": f"{deployment_name}-scaledobject",
+            "name": scaled_object_name,
             "namespace": namespace
         },
         "spec": {
@@ -170,48 +314,115 @@ def create_scaled_object(deployment_name, metric_name, threshold, namespace="def
         }
     }
 
-    custom_objects_api = client.CustomObjectsApi()
+    _CO.patch_namespaced_custom_object(
+        group="keda.sh",
+        version="v1alpha1",
+        namespace=namespace,
+        plural="scaledobjects",
+        name=scaled_object_name,
+        body=scaled_object,
+        field_manager=FIELD_MANAGER,
+        force=True,
+        _content_type=APPLY_PATCH_CONTENT_TYPE
+    )
+    print(f"ScaledObject {scaled_object_name} applied in namespace {namespace}.")
+
+def _deployment_health_status(deployment):
+    """Classify a deployment the way kubectl rollout status does."""
+    status = deployment.status
+    if (status.observed_generation or 0) < deployment.metadata.generation:
+        return "Progressing"
+    replicas = deployment.spec.replicas or 0
+    if (status.updated_replicas or 0) == replicas and (status.available_replicas or 0) == replicas:
+        return "Healthy"
+    return "Unhealthy"
+
+@_api_call("checking deployment health")
+def get_deployment_health(deployment_name, namespace="default", use_cache=True):
+    """Check the health status of a deployment by name.
+
+    Results are cached for CACHE_TTL seconds; pass use_cache=False to force a fresh read.
+    """
+    key = (deployment_name, namespace)
+    if use_cache:
+        cached = _health_cache.get(key)
+        if cached is not None and time.monotonic() - cached[0] < CACHE_TTL:
+            return cached[1]
+
     try:
-        custom_objects_api.create_namespaced_custom_object(
-            group="keda.sh",
-            version="v1alpha1",
-            namespace=namespace,
-            plural="scaledobjects",
-            body=scaled_object
-        )
-        print(f"ScaledObject {deployment_name}-scaledobject created in namespace {namespace}.")
+        deployment = _APPS.read_namespaced_deployment_status(name=deployment_name, namespace=namespace)
     except client.exceptions.ApiException as e:
-        print(f"Exception when creating ScaledObject: {e}")
-        raise
+        if e.status != 404:
+            raise
+        print(f"Deployment {deployment_name} not found.")
+        return "Not Found"
+    health_status = _deployment_health_status(deployment)
+    print(f"Deployment {deployment_name} health status: {health_status}")
+    _health_cache[key] = (time.monotonic(), health_status)
+    return health_status
+
+def _is_deployment_ready(deployment):
+    """Return True when the deployment has fully rolled out."""
+    return _deployment_health_status(deployment) == "Healthy"
+
+@_api_call("waiting for deployment")
+def wait_for_deployment_ready(deployment_name, namespace="default", timeout=120):
+    """Block until the deployment is ready, using the watch API instead of polling."""
+    deadline = time.monotonic() + timeout
+
+    while True:
+        deployment = _APPS.read_namespaced_deployment_status(name=deployment_name, namespace=namespace)
+        if _is_deployment_ready(deployment):
+            print(f"Deployment {deployment_name} is ready.")
+            return True
 
-def get_deployment_health(deployment_id, namespace="default"):
-    """Check the health status of a deployment by ID."""
-    api_instance = client.AppsV1Api()
+        remaining = int(deadline - time.monotonic())
+        if remaining <= 0:
+            break
 
+        w = watch.Watch()
+        try:
+            for event in w.stream(
+                _APPS.list_namespaced_deployment,
+                namespace=namespace,
+                field_selector=f"metadata.name={deployment_name}",
+                resource_version=deployment.metadata.resource_version,
+                timeout_seconds=remaining,
+            ):
+                if event["type"] == "MODIFIED" and _is_deployment_ready(event["object"]):
+                    print(f"Deployment {deployment_name} is ready.")
+                    return True
+            break
+        except client.exceptions.ApiException as e:
+            # 410 Gone: our resource version expired, restart from a fresh read.
+            if e.status != 410:
+                raise
+        finally:
+            w.stop()
+
+    print(f"Timed out waiting for deployment {deployment_name} to become ready.")
+    return False
+
+async def bootstrap():
+    """Start Minikube, install Helm and KEDA, and verify the KEDA pods."""
+    # Helm can be fetched while Minikube boots; if either fails, cancel the other.
+    tasks = [asyncio.ensure_future(start_minikube()), asyncio.ensure_future(install_helm())]
     try:
-        deployments = api_instance.list_namespaced_deployment(namespace=namespace).items
-        for deployment in deployments:
-            if deployment.metadata.uid == deployment_id:
-                status = deployment.status
-                ready_replicas = status.ready_replicas or 0
-                replicas = status.replicas or 0
-                health_status = "Healthy" if ready_replicas == replicas else "Unhealthy"
-                print(f"Deployment {deployment.metadata.name} health status: {health_status}")
-                return health_status
-        print(f"Deployment with ID {deployment_id} not found.")
-        return "Not Found"
-    except client.exceptions.ApiException as e:
-        print(f"Exception when checking deployment health: {e}")
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
         raise
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, load_minikube_config)
+    await install_keda()
+    await verify_keda_installation()
 
 def main():
     """Main script entry point."""
     try:
-        start_minikube()
-        load_minikube_config()
-        install_helm()
-        install_keda()
-        verify_keda_installation()
+        asyncio.run(bootstrap())
 
         deployment_name = "example-deployment"
         image = "nginx:latest"
@@ -222,12 +433,18 @@ def main():
         memory_request = "128Mi"
         memory_limit = "256Mi"
 
-        deployment_id = create_deployment(deployment_name, image, namespace, cpu_request, cpu_limit, memory_request, memory_limit, ports)
-        create_service(deployment_name, namespace, ports)
-        create_scaled_object(deployment_name, metric_name="cpu", threshold=50, namespace=namespace)
+        # KEDA's admission webhook looks up the ScaledObject's target, so the
+        # Deployment goes first; the Service and ScaledObject can then be applied concurrently.
+        deployment_name = create_deployment(deployment_name, image, namespace, cpu_request, cpu_limit, memory_request, memory_limit, ports)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            service_future = executor.submit(create_service, deployment_name, namespace, ports)
+            scaled_object_future = executor.submit(create_scaled_object, deployment_name, metric_name="cpu", threshold=50, namespace=namespace)
+            service_future.result()
+            scaled_object_future.result()
 
-        # Check health status of the deployment
-        get_deployment_health(deployment_id, namespace)
+        # Wait for the rollout, then check health status of the deployment
+        wait_for_deployment_ready(deployment_name, namespace)
+        get_deployment_health(deployment_name, namespace)
     except Exception as e:
         print(f"An error occurred: {e}")
 